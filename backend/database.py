@@ -0,0 +1,91 @@
+import orjson
+from sqlalchemy import create_engine, event, text, Column, Integer, String, Boolean, ForeignKey, Index, JSON
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql import func
+
+# --- DATABASE ---
+SQLALCHEMY_DATABASE_URL = "sqlite:///./study.db"
+def _json_loads(value: str):
+    return [] if value == "[]" else orjson.loads(value) # Empty lists are the common case, skip the parse
+
+# JSON columns (de)serialise through orjson instead of the stdlib json module
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False},
+                       json_serializer=lambda v: orjson.dumps(v).decode(), json_deserializer=_json_loads)
+
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_conn, _):
+    # WAL lets readers run alongside a writer; NORMAL drops the fsync on every commit
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA synchronous=NORMAL")
+    cur.execute("PRAGMA temp_store=MEMORY")
+    cur.execute("PRAGMA mmap_size=268435456") # 256 MiB
+    cur.execute("PRAGMA cache_size=-65536") # 64 MiB
+    cur.close()
+
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine) # No reload SELECTs after commit
+Base = declarative_base()
+
+# --- MODELS ---
+class User(Base):
+    __tablename__ = "users"
+    id = Column(Integer, primary_key=True, index=True)
+    username = Column(String, unique=True, index=True)
+    hashed_password = Column(String)
+
+class StudyLog(Base):
+    __tablename__ = "study_logs"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id")) # Linked to User
+    topic = Column(String)
+    duration_minutes = Column(Integer)
+    timestamp = Column(Integer, server_default=func.strftime("%s", "now")) # UTC epoch seconds, set by SQLite
+    xp_earned = Column(Integer)
+    __table_args__ = (Index("ix_logs_user_ts", "user_id", "timestamp"),) # Serves /user-stats filter + ORDER BY
+
+class UserStats(Base):
+    __tablename__ = "user_stats"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id")) # Linked to User
+    total_xp = Column(Integer, default=0)
+
+class PlannedTask(Base):
+    __tablename__ = "planned_tasks"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id")) # Linked to User
+    date = Column(String) 
+    time = Column(String)
+    task = Column(String)
+    type = Column(String)
+    reason = Column(String, nullable=True)
+    key_concepts = Column(JSON, nullable=True) # (De)serialised once at the ORM boundary
+    suggested_resources = Column(JSON, nullable=True)
+    completed = Column(Boolean, default=False)
+    __table_args__ = (Index("ix_tasks_user_date", "user_id", "date"),) # Serves /calendar/get lookups
+
+def _migrate_study_log_timestamps():
+    # study_logs used to store ISO text timestamps; rebuild it with the INTEGER epoch column
+    with engine.begin() as conn:
+        cols = {row[1]: row[2] for row in conn.execute(text("PRAGMA table_info(study_logs)"))}
+        if cols.get("timestamp", "INTEGER").upper() == "INTEGER": return
+        conn.execute(text("ALTER TABLE study_logs RENAME TO study_logs_old"))
+        for (name,) in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'study_logs_old' AND sql IS NOT NULL")).all():
+            conn.execute(text(f'DROP INDEX "{name}"'))
+        StudyLog.__table__.create(conn)
+        conn.execute(text(
+            "INSERT INTO study_logs (id, user_id, topic, duration_minutes, timestamp, xp_earned) "
+            "SELECT id, user_id, topic, duration_minutes, CAST(strftime('%s', timestamp) AS INTEGER), xp_earned FROM study_logs_old"))
+        conn.execute(text("DROP TABLE study_logs_old"))
+
+def init_db():
+    # Run once per deploy (gunicorn's on_starting, or main's lifespan under plain uvicorn), not on every worker import.
+    # Lives here rather than in main so the gunicorn master can run it without loading the app
+    _migrate_study_log_timestamps()
+    Base.metadata.create_all(bind=engine)
+    # create_all skips indexes on tables that already exist, so bring older DBs up to date
+    with engine.begin() as conn:
+        for table in (StudyLog.__table__, PlannedTask.__table__):
+            for index in table.indexes: index.create(conn, checkfirst=True)
+        conn.execute(text("DROP INDEX IF EXISTS ix_planned_tasks_date")) # Superseded by ix_tasks_user_date
+    engine.dispose() # Don't hand pooled SQLite connections to forked workers
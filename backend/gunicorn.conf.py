@@ -0,0 +1,20 @@
+import multiprocessing
+import os
+
+# Production: gunicorn -c gunicorn.conf.py (run from backend/)
+# Several worker processes so PDF parsing and password hashing use every core
+wsgi_app = "main:app"
+bind = "0.0.0.0:8000"
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+worker_class = "uvicorn_worker.UvicornWorker" # Picks up uvloop + httptools when installed
+worker_tmp_dir = "/dev/shm" # Heartbeat file off disk
+timeout = 60
+
+def on_starting(server):
+    # Workers inherit the environment; main.py splits GEMINI_CONCURRENCY by the final count (incl. -w)
+    os.environ["WEB_CONCURRENCY"] = str(server.cfg.workers)
+    # Create/migrate the schema once in the master instead of in every worker.
+    # database.py doesn't import the app, so workers still load main fresh (no implicit preload)
+    from database import init_db
+    init_db()
+    os.environ["CEREBRA_DB_READY"] = "1" # Inherited by the workers, so their lifespan skips init_db
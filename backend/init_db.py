@@ -0,0 +1,6 @@
+# Create tables and indexes ahead of time. Optional: the app's startup (or gunicorn's on_starting) does it too.
+from database import init_db
+
+if __name__ == "__main__":
+    init_db()
+    print("Database ready")
@@ -1,81 +1,71 @@
 import os
+import sys
 import json
 import datetime
 import io
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+import asyncio
+import tempfile
+import time
+import hashlib
+import logging
 from typing import List, Optional
 from datetime import timedelta
 
+import httpx
+import orjson
 from fastapi import FastAPI, UploadFile, File, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, ConfigDict, field_validator
 from dotenv import load_dotenv
 
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Boolean, ForeignKey
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session, relationship
+from sqlalchemy.orm import Session
+from database import SessionLocal, User, StudyLog, UserStats, PlannedTask, init_db
 import pypdf
 from PIL import Image 
+from aiocache import Cache
 
 from google import genai
 from google.genai import types
 from passlib.context import CryptContext
+from cachetools import TTLCache
 from jose import JWTError, jwt
 
+if sys.platform != "win32": # uvloop has no Windows build
+    import uvloop
+    uvloop.install()
+
 load_dotenv()
-client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+logger = logging.getLogger("cerebra")
+# One pooled async HTTP client for every request, so TLS/connection setup is paid once
+client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"), http_options=types.HttpOptions(
+    async_client_args={"limits": httpx.Limits(max_connections=50, max_keepalive_connections=50)}))
 
 # --- CONFIG ---
 SECRET_KEY = "YOUR_SUPER_SECRET_KEY_HERE" # Change this for production!
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 300
-
-# --- DATABASE ---
-SQLALCHEMY_DATABASE_URL = "sqlite:///./study.db"
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
-
-# --- MODELS ---
-class User(Base):
-    __tablename__ = "users"
-    id = Column(Integer, primary_key=True, index=True)
-    username = Column(String, unique=True, index=True)
-    hashed_password = Column(String)
-
-class StudyLog(Base):
-    __tablename__ = "study_logs"
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id")) # Linked to User
-    topic = Column(String)
-    duration_minutes = Column(Integer)
-    timestamp = Column(DateTime, default=datetime.datetime.utcnow)
-    xp_earned = Column(Integer)
-
-class UserStats(Base):
-    __tablename__ = "user_stats"
-    id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, ForeignKey("users.id")) # Linked to User
-    total_xp = Column(Integer, default=0)
-
-class PlannedTask(Base):
-    __tablename__ = "planned_tasks"
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id")) # Linked to User
-    date = Column(String, index=True) 
-    time = Column(String)
-    task = Column(String)
-    type = Column(String)
-    reason = Column(String, nullable=True)
-    key_concepts = Column(String, nullable=True)
-    suggested_resources = Column(String, nullable=True)
-    completed = Column(Boolean, default=False)
-
-Base.metadata.create_all(bind=engine)
+REQUEST_TIMEOUT = float(os.getenv("GEMINI_REQUEST_TIMEOUT", "15")) # Seconds per Gemini attempt
+REQUEST_RETRIES = 3
+# GEMINI_CONCURRENCY is the whole deployment's quota; each worker process gets an even share
+GEMINI_WORKERS = int(os.getenv("WEB_CONCURRENCY", "1"))
+GEMINI_SEM = asyncio.Semaphore(max(1, int(os.getenv("GEMINI_CONCURRENCY", "20")) // GEMINI_WORKERS))
+SYLLABUS_TOKEN_BUDGET = int(os.getenv("SYLLABUS_TOKEN_BUDGET", "4000"))
+CHARS_PER_TOKEN = 4 # Typical English ratio, only used to size how much text to read up front
+RESPONSE_CACHE_TTL_SECONDS = 86400
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE", "0") == "1" # Costs one embedding call per quiz miss
+SEMANTIC_CACHE_THRESHOLD = 0.95
+SEMANTIC_CACHE_MAX_ENTRIES = 10000
+EMBEDDING_MODEL = os.getenv("GEMINI_EMBEDDING_MODEL", "gemini-embedding-001")
+if SEMANTIC_CACHE_ENABLED: import numpy as np # Optional dependency, only the semantic tier needs it
 
 # --- SECURITY UTILS ---
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(schemes=["argon2", "bcrypt"], deprecated="auto") # bcrypt kept to verify legacy hashes
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+_token_cache = TTLCache(maxsize=10_000, ttl=60) # Raw token -> decoded payload
 
 def get_db():
     db = SessionLocal()
@@ -94,22 +84,53 @@ def create_access_token(data: dict):
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+def decode_access_token(token: str):
+    payload = _token_cache.get(token)
+    if payload is None:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        _token_cache[token] = payload
+    elif payload["exp"] <= time.time(): raise JWTError("Signature has expired.")
+    return payload
+
+@dataclass(frozen=True)
+class CurrentUser:
+    id: int
+    username: str
+
+def _lookup_user(username: str):
+    with SessionLocal() as db:
+        user = db.query(User).filter(User.username == username).first()
+        return CurrentUser(id=user.id, username=user.username) if user else None
+
+async def get_current_user(token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_access_token(token)
         username: str = payload.get("sub")
         if username is None: raise credentials_exception
     except JWTError: raise credentials_exception
-    user = db.query(User).filter(User.username == username).first()
+    if "uid" in payload: return CurrentUser(id=payload["uid"], username=username) # No DB round trip
+    # Legacy tokens issued before "uid" was embedded; query in a thread, off the event loop
+    user = await asyncio.to_thread(_lookup_user, username)
     if user is None: raise credentials_exception
     return user
 
-app = FastAPI(title="Cerebra Engine")
+class ORJSONResponse(JSONResponse):
+    # Same as fastapi.responses.ORJSONResponse, which newer FastAPI releases deprecate
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # gunicorn's on_starting already did this once for all workers; plain `uvicorn main:app` hasn't
+    if os.getenv("CEREBRA_DB_READY") != "1": await asyncio.to_thread(init_db)
+    yield
+
+app = FastAPI(title="Cerebra Engine", default_response_class=ORJSONResponse, lifespan=lifespan)
 
 origins = [
     "http://localhost:5173",
@@ -138,19 +159,29 @@ def register(user: UserCreate, db: Session = Depends(get_db)):
     hashed_password = get_password_hash(user.password)
     new_user = User(username=user.username, hashed_password=hashed_password)
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    db.flush() # Assigns new_user.id without a separate commit + refresh
     # Init Stats
     db.add(UserStats(user_id=new_user.id, total_xp=0))
     db.commit()
     return {"msg": "User created successfully"}
 
+def _authenticate(username: str, password: str):
+    # Runs in a worker thread: the lookup, the deliberately slow hash check and any rehash commit
+    with SessionLocal() as db:
+        user = db.query(User).filter(User.username == username).first()
+        if not user: return None
+        valid, new_hash = pwd_context.verify_and_update(password, user.hashed_password)
+        if not valid: return None
+        if new_hash: # Legacy bcrypt hash, upgrade to argon2 now that we know the password
+            user.hashed_password = new_hash
+            db.commit()
+        return CurrentUser(id=user.id, username=user.username)
+
 @app.post("/token")
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
-        raise HTTPException(status_code=400, detail="Incorrect username or password")
-    access_token = create_access_token(data={"sub": user.username})
+async def login(form_data: OAuth2PasswordRequestForm = Depends()):
+    user = await asyncio.to_thread(_authenticate, form_data.username, form_data.password)
+    if not user: raise HTTPException(status_code=400, detail="Incorrect username or password")
+    access_token = create_access_token(data={"sub": user.username, "uid": user.id})
     return {"access_token": access_token, "token_type": "bearer"}
 
 # --- AI ENDPOINTS ---
@@ -163,26 +194,191 @@ class ScheduleRequest(BaseModel):
 
 def get_best_model(): return "gemini-flash-latest"
 
+# Fixed instructions + schema per endpoint, sent as system_instruction; contents carry only the request's delta.
+# Far below Gemini's 1024-token minimum for explicit context caching, so there is nothing to cache here
+PROMPT_TEMPLATES = {
+    "syllabus": "Analyze the syllabus you are given. Return STRICT JSON: { \"syllabus\": [ { \"module\": \"Name\", \"subtopics\": [\"Sub 1\"] } ] }",
+    "plan": "Create a study schedule from the date, start time, energy level, hours and topics you are given. Return JSON: { \"schedule\": [ { \"time\": \"HH:MM - HH:MM\", \"task\": \"Topic\", \"type\": \"Deep Work/Break\", \"reason\": \"Strategy\", \"key_concepts\": [], \"suggested_resources\": [] } ], \"tip\": \"Motivation\" }",
+    "quiz": "Create 3 hard MCQs for the topic you are given. Return JSON: { 'questions': [ { 'question': '?', 'options': ['A','B'], 'answer': 'A' } ] }",
+}
+def _gen_config(template: Optional[str], cfg: dict):
+    cfg.setdefault("response_mime_type", "application/json")
+    if template: cfg["system_instruction"] = PROMPT_TEMPLATES[template]
+    return types.GenerateContentConfig(**cfg)
+
+async def _call_gemini(make_call):
+    # Time out just above typical latency and retry, so one stalled call doesn't hold the request
+    for attempt in range(REQUEST_RETRIES):
+        try:
+            async with GEMINI_SEM: # Queueing time doesn't count against the timeout
+                return await asyncio.wait_for(make_call(), timeout=REQUEST_TIMEOUT)
+        except asyncio.TimeoutError:
+            if attempt == REQUEST_RETRIES - 1: raise
+            await asyncio.sleep(0.5 * 2 ** attempt)
+
+async def _gen(contents, template: Optional[str] = None, **cfg):
+    config = _gen_config(template, cfg)
+    return await _call_gemini(lambda: client.aio.models.generate_content(model=get_best_model(), contents=contents, config=config))
+
+async def _gen_stream(contents, template: Optional[str] = None, **cfg):
+    # Yields response text chunks. Each chunk gets the _gen timeout; retries only happen before the
+    # first chunk, and the GEMINI_SEM slot is held until the stream is drained or closed
+    config = _gen_config(template, cfg)
+    for attempt in range(REQUEST_RETRIES):
+        async with GEMINI_SEM:
+            stream = None
+            try:
+                stream = await asyncio.wait_for(
+                    client.aio.models.generate_content_stream(model=get_best_model(), contents=contents, config=config),
+                    timeout=REQUEST_TIMEOUT,
+                )
+                first = await asyncio.wait_for(anext(stream), timeout=REQUEST_TIMEOUT)
+            except asyncio.TimeoutError:
+                if stream is not None: await stream.aclose() # Abandon the stalled attempt
+                if attempt == REQUEST_RETRIES - 1: raise
+            else:
+                try:
+                    if first.text: yield first.text
+                    while True:
+                        try: chunk = await asyncio.wait_for(anext(stream), timeout=REQUEST_TIMEOUT)
+                        except StopAsyncIteration: return
+                        if chunk.text: yield chunk.text
+                finally: await stream.aclose()
+        await asyncio.sleep(0.5 * 2 ** attempt)
+
+# --- RESPONSE CACHE ---
+# Exact tier: shared Redis when REDIS_URL is set, otherwise per-process memory
+def _make_response_cache():
+    url = os.getenv("REDIS_URL")
+    if url:
+        try: return Cache.from_url(url)
+        except Exception as e: logger.warning("REDIS_URL unusable (%s); using per-process memory cache", e)
+    return Cache(Cache.MEMORY)
+
+response_cache = _make_response_cache()
+_semantic_keys: List[str] = []
+_semantic_vectors = None # Unit-normalised rows, aligned with _semantic_keys
+
+def _cache_key(kind: str, payload: str):
+    return f"{kind}:{hashlib.sha256(payload.encode()).hexdigest()}"
+
+async def _embed(text: str):
+    result = await client.aio.models.embed_content(model=EMBEDDING_MODEL, contents=text)
+    vec = np.asarray(result.embeddings[0].values, dtype=np.float32)
+    return vec / np.linalg.norm(vec)
+
+def _semantic_lookup(vec):
+    if not _semantic_keys: return None
+    scores = _semantic_vectors @ vec
+    best = int(np.argmax(scores))
+    return _semantic_keys[best] if scores[best] >= SEMANTIC_CACHE_THRESHOLD else None
+
+def _semantic_remember(key: str, vec):
+    global _semantic_vectors
+    _semantic_vectors = vec[None, :] if not _semantic_keys else np.vstack([_semantic_vectors, vec])[-SEMANTIC_CACHE_MAX_ENTRIES:]
+    _semantic_keys.append(key)
+    del _semantic_keys[:-SEMANTIC_CACHE_MAX_ENTRIES]
+
+async def _cached_gen(key: str, contents, template: str, semantic_text: Optional[str] = None):
+    text = await response_cache.get(key)
+    if text is not None: return orjson.loads(text)
+    vec = None
+    if semantic_text is not None and SEMANTIC_CACHE_ENABLED:
+        try:
+            vec = await _embed(semantic_text)
+            near_key = _semantic_lookup(vec)
+            text = await response_cache.get(near_key) if near_key else None
+            if text is not None: return orjson.loads(text)
+        except Exception: vec = None # Embedding trouble must never fail the request itself
+    text = (await _gen(contents, template=template)).text
+    data = orjson.loads(text) # Only cache responses that parse
+    await response_cache.set(key, text, ttl=RESPONSE_CACHE_TTL_SECONDS)
+    if vec is not None: _semantic_remember(key, vec)
+    return data
+
+async def _stream_and_cache(key: str, first: str, stream):
+    # An error or stall past the first chunk propagates out of here, so the server aborts the
+    # chunked response rather than ending it cleanly; the client sees a failed request, not bad JSON
+    parts = [first]
+    yield first
+    async for text in stream:
+        parts.append(text)
+        yield text
+    text = "".join(parts)
+    # A complete but unparseable body gets the same treatment: abort instead of a clean 200
+    try: orjson.loads(text)
+    except ValueError as e: raise ValueError("Gemini returned malformed JSON") from e
+    await response_cache.set(key, text, ttl=RESPONSE_CACHE_TTL_SECONDS)
+
+def _plan_cache_key(state: ScheduleRequest):
+    return _cache_key("plan", json.dumps(state.model_dump(include=set(ScheduleRequest.model_fields)), sort_keys=True))
+
+def _quiz_cache_key(topic: str):
+    return _cache_key("quiz", topic.lower().strip())
+
+UPLOAD_CHUNK_SIZE = 1 << 20 # 1 MiB per read
+UPLOAD_SPOOL_MAX = 8 << 20 # Spill to disk past 8 MiB
+INLINE_IMAGE_MAX_BYTES = 4 << 20 # Larger images get downscaled before upload
+IMAGE_MAX_SIDE = 2048
+
+async def _spool_upload(file: UploadFile):
+    spool = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MAX)
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+        spool.write(chunk)
+    spool.seek(0)
+    return spool
+
+def _extract_pdf_text(spool, max_chars: int):
+    reader = pypdf.PdfReader(spool)
+    parts, total = [], 0
+    for page in reader.pages:
+        parts.append(page.extract_text() or "")
+        total += len(parts[-1]) + 1
+        if total >= max_chars: break # Don't parse pages we'd only truncate away
+    return "\n".join(parts)
+
+async def _truncate_to_tokens(text: str, budget: int):
+    # Every token covers at least one character (CJK is close to that), so len(text) is
+    # an upper bound on the token count whatever the script
+    if len(text) <= budget: return text
+    for _ in range(3):
+        try:
+            result = await _call_gemini(lambda: client.aio.models.count_tokens(model=get_best_model(), contents=text))
+        except Exception: break # Tokenizer unavailable, fall through to the worst-case cut
+        if result.total_tokens <= budget: return text
+        text = text[:int(len(text) * budget / result.total_tokens * 0.95)]
+    return text[:budget] # Tokenizer unavailable or still over after the last trim: cut to the worst case
+
+def _image_part(spool, mime_type: str):
+    data = spool.read()
+    # Common case: hand Gemini the original bytes, no decode/re-encode round trip
+    if len(data) <= INLINE_IMAGE_MAX_BYTES: return types.Part.from_bytes(data=data, mime_type=mime_type)
+    image = Image.open(io.BytesIO(data))
+    image.thumbnail((IMAGE_MAX_SIDE, IMAGE_MAX_SIDE), Image.LANCZOS)
+    out = io.BytesIO()
+    image.convert("RGB").save(out, format="JPEG", quality=90)
+    return types.Part.from_bytes(data=out.getvalue(), mime_type="image/jpeg")
+
 @app.post("/analyze-syllabus")
 async def analyze_syllabus(file: UploadFile = File(...)):
-    content = await file.read()
-    mime_type = file.content_type
-    prompt_text = "Analyze this syllabus. Return STRICT JSON: { \"syllabus\": [ { \"module\": \"Name\", \"subtopics\": [\"Sub 1\"] } ] }"
+    spool = await _spool_upload(file)
+    mime_type = file.content_type or ""
     try:
         response = None
         if "pdf" in mime_type:
-            pdf_reader = pypdf.PdfReader(io.BytesIO(content))
-            raw_text = ""
-            for page in pdf_reader.pages: raw_text += page.extract_text() + "\n"
-            response = client.models.generate_content(model=get_best_model(), contents=f"{prompt_text}\n\nTEXT:\n{raw_text[:8000]}", config=types.GenerateContentConfig(response_mime_type="application/json"))
+            # Over-read a little so the token-accurate cut below has room to work with
+            raw_text = await asyncio.to_thread(_extract_pdf_text, spool, SYLLABUS_TOKEN_BUDGET * CHARS_PER_TOKEN * 3 // 2)
+            raw_text = await _truncate_to_tokens(raw_text, SYLLABUS_TOKEN_BUDGET)
+            response = await _gen(f"TEXT:\n{raw_text}", template="syllabus")
         elif "image" in mime_type:
-            image = Image.open(io.BytesIO(content))
-            response = client.models.generate_content(model=get_best_model(), contents=[prompt_text, image], config=types.GenerateContentConfig(response_mime_type="application/json"))
+            part = await asyncio.to_thread(_image_part, spool, mime_type)
+            response = await _gen([part], template="syllabus")
         elif "text" in mime_type:
-            text_content = content.decode("utf-8")
-            response = client.models.generate_content(model=get_best_model(), contents=f"{prompt_text}\n\nTEXT:\n{text_content[:8000]}", config=types.GenerateContentConfig(response_mime_type="application/json"))
+            text_content = spool.read().decode("utf-8")
+            text_content = await _truncate_to_tokens(text_content[:SYLLABUS_TOKEN_BUDGET * CHARS_PER_TOKEN * 3 // 2], SYLLABUS_TOKEN_BUDGET)
+            response = await _gen(f"TEXT:\n{text_content}", template="syllabus")
         else: return {"error": "Unsupported file"}
-        data = json.loads(response.text)
+        data = orjson.loads(response.text)
         formatted_topics = []
         for item in data.get("syllabus", []):
             module = item.get("module", "Topic")
@@ -190,20 +386,45 @@ async def analyze_syllabus(file: UploadFile = File(...)):
             formatted_topics.append(f"{module} ({subs})")
         return {"topics": formatted_topics}
     except Exception as e: return {"topics": [], "error": str(e)}
+    finally: spool.close()
 
-@app.post("/generate-plan")
-def generate_plan(state: ScheduleRequest, current_user: User = Depends(get_current_user)):
-    style = "balanced"
-    if state.energy_level == "Low": style = "Passive Learning"
-    elif state.energy_level == "High": style = "Active Recall"
-    prompt = f"""
+def _plan_prompt(state: ScheduleRequest):
+    return f"""
     Create schedule for {state.date}, start {state.current_time}. Energy: {state.energy_level}. Time: {state.hours_available}h.
     Topics: {json.dumps(state.subjects)}
-    Return JSON: {{ "schedule": [ {{ "time": "HH:MM - HH:MM", "task": "Topic", "type": "Deep Work/Break", "reason": "Strategy", "key_concepts": [], "suggested_resources": [] }} ], "tip": "Motivation" }}
     """
+
+def _quiz_prompt(topic: str):
+    return f"Topic: '{topic}'"
+
+@app.post("/generate-plan")
+async def generate_plan(state: ScheduleRequest, current_user: CurrentUser = Depends(get_current_user)):
+    key = _plan_cache_key(state)
+    stream = None
+    try:
+        cached = await response_cache.get(key)
+        if cached is not None: return Response(cached, media_type="application/json")
+        stream = _gen_stream(_plan_prompt(state), template="plan")
+        # Wait for the first chunk here so failures still come back as {"error": ...}
+        first = await anext(stream)
+    except Exception as e:
+        if stream is not None: await stream.aclose()
+        return {"error": str(e)}
+    return StreamingResponse(_stream_and_cache(key, first, stream), media_type="application/json")
+
+class PlanWithQuizRequest(ScheduleRequest):
+    quiz_topic: Optional[str] = None # Defaults to the first subject
+
+@app.post("/generate-plan-with-quiz")
+async def generate_plan_with_quiz(state: PlanWithQuizRequest, current_user: CurrentUser = Depends(get_current_user)):
+    quiz_topic = state.quiz_topic or (state.subjects[0] if state.subjects else "General Study")
     try:
-        response = client.models.generate_content(model=get_best_model(), contents=prompt, config=types.GenerateContentConfig(response_mime_type="application/json"))
-        return json.loads(response.text)
+        # Independent calls, so wall time is the slower of the two rather than their sum
+        plan, quiz = await asyncio.gather(
+            _cached_gen(_plan_cache_key(state), _plan_prompt(state), "plan"),
+            _cached_gen(_quiz_cache_key(quiz_topic), _quiz_prompt(quiz_topic), "quiz", semantic_text=quiz_topic),
+        )
+        return {"plan": plan, "quiz": quiz}
     except Exception as e: return {"error": str(e)}
 
 # --- USER DATA ENDPOINTS (PROTECTED) ---
@@ -213,8 +434,19 @@ class LogRequest(BaseModel):
     duration: int
     xp: int 
 
+class StudyLogOut(BaseModel):
+    id: int
+    topic: Optional[str] = None
+    duration_minutes: Optional[int] = None
+    timestamp: Optional[datetime.datetime] = None
+    xp_earned: Optional[int] = None
+
+class StatsOut(BaseModel):
+    total_xp: int
+    history: List[StudyLogOut]
+
 @app.post("/log-session")
-def log_session(log: LogRequest, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+def log_session(log: LogRequest, db: Session = Depends(get_db), current_user: CurrentUser = Depends(get_current_user)):
     db_log = StudyLog(user_id=current_user.id, topic=log.topic, duration_minutes=log.duration, xp_earned=log.xp)
     db.add(db_log)
     stats = db.query(UserStats).filter(UserStats.user_id == current_user.id).first()
@@ -225,15 +457,17 @@ def log_session(log: LogRequest, db: Session = Depends(get_db), current_user: Us
     db.commit()
     return {"status": "Logged", "total_xp": stats.total_xp}
 
-@app.get("/user-stats")
-def get_stats(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    stats = db.query(UserStats).filter(UserStats.user_id == current_user.id).first()
-    if not stats: stats = UserStats(user_id=current_user.id, total_xp=0)
-    logs = db.query(StudyLog).filter(StudyLog.user_id == current_user.id).order_by(StudyLog.timestamp.desc()).limit(50).all()
-    return {"total_xp": stats.total_xp, "history": logs}
+@app.get("/user-stats", response_model=StatsOut)
+def get_stats(db: Session = Depends(get_db), current_user: CurrentUser = Depends(get_current_user)):
+    # Project plain columns so SQLAlchemy returns rows, not hydrated ORM instances
+    total_xp = db.query(UserStats.total_xp).filter(UserStats.user_id == current_user.id).limit(1).scalar() # Tolerates duplicate stats rows
+    logs = (db.query(StudyLog.id, StudyLog.topic, StudyLog.duration_minutes, StudyLog.timestamp, StudyLog.xp_earned)
+            .filter(StudyLog.user_id == current_user.id).order_by(StudyLog.timestamp.desc()).limit(50).all())
+    # StatsOut turns the epoch ints into UTC datetimes during serialisation
+    return {"total_xp": total_xp or 0, "history": [row._asdict() for row in logs]}
 
 @app.delete("/reset-history")
-def reset_history(reset_xp: bool = False, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+def reset_history(reset_xp: bool = False, db: Session = Depends(get_db), current_user: CurrentUser = Depends(get_current_user)):
     db.query(StudyLog).filter(StudyLog.user_id == current_user.id).delete()
     if reset_xp:
         stats = db.query(UserStats).filter(UserStats.user_id == current_user.id).first()
@@ -251,6 +485,25 @@ class TaskCreate(BaseModel):
     key_concepts: List[str] = []
     suggested_resources: List[str] = []
 
+class TaskOut(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+    id: int
+    date: str
+    time: Optional[str] = None
+    task: Optional[str] = None
+    type: Optional[str] = None
+    reason: Optional[str] = None
+    key_concepts: List[str] = []
+    suggested_resources: List[str] = []
+    completed: bool = False
+
+    @field_validator("key_concepts", "suggested_resources", mode="before")
+    @classmethod
+    def _none_as_empty(cls, v): return v or []
+
+class TasksOut(BaseModel):
+    tasks: List[TaskOut]
+
 class TaskUpdate(BaseModel):
     task: str
     time: str
@@ -259,46 +512,48 @@ class QuizRequest(BaseModel):
     topic: str
 
 @app.post("/calendar/add")
-def add_calendar_task(task: TaskCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    concepts_str = json.dumps(task.key_concepts)
-    resources_str = json.dumps(task.suggested_resources)
+def add_calendar_task(task: TaskCreate, db: Session = Depends(get_db), current_user: CurrentUser = Depends(get_current_user)):
     db_task = PlannedTask(
         user_id=current_user.id,
         date=task.date, time=task.time, task=task.task, type=task.type,
-        reason=task.reason, key_concepts=concepts_str, suggested_resources=resources_str
+        reason=task.reason, key_concepts=task.key_concepts, suggested_resources=task.suggested_resources
     )
     db.add(db_task)
     db.commit()
     return {"status": "Added"}
 
-@app.get("/calendar/get")
-def get_calendar_tasks(date: str, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+@app.post("/calendar/add-batch")
+def add_calendar_tasks(tasks: List[TaskCreate], db: Session = Depends(get_db), current_user: CurrentUser = Depends(get_current_user)):
+    # One transaction for the whole plan instead of a commit (and fsync) per task
+    rows = [{
+        "user_id": current_user.id,
+        "date": t.date, "time": t.time, "task": t.task, "type": t.type, "reason": t.reason,
+        "key_concepts": t.key_concepts, "suggested_resources": t.suggested_resources
+    } for t in tasks]
+    db.bulk_insert_mappings(PlannedTask, rows)
+    db.commit()
+    return {"status": "Added", "count": len(rows)}
+
+@app.get("/calendar/get", response_model=TasksOut)
+def get_calendar_tasks(date: str, db: Session = Depends(get_db), current_user: CurrentUser = Depends(get_current_user)):
     tasks = db.query(PlannedTask).filter(PlannedTask.user_id == current_user.id, PlannedTask.date == date).all()
-    result = []
-    for t in tasks:
-        result.append({
-            "id": t.id, "date": t.date, "time": t.time, "task": t.task, "type": t.type, "reason": t.reason,
-            "key_concepts": json.loads(t.key_concepts) if t.key_concepts else [],
-            "suggested_resources": json.loads(t.suggested_resources) if t.suggested_resources else [],
-            "completed": t.completed
-        })
-    return {"tasks": result}
+    return {"tasks": tasks} # response_model validates the ORM rows and Pydantic serialises the payload
 
 @app.delete("/calendar/delete/{task_id}")
-def delete_calendar_task(task_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+def delete_calendar_task(task_id: int, db: Session = Depends(get_db), current_user: CurrentUser = Depends(get_current_user)):
     db.query(PlannedTask).filter(PlannedTask.id == task_id, PlannedTask.user_id == current_user.id).delete()
     db.commit()
     return {"status": "Deleted"}
 
 @app.delete("/calendar/reset")
-def reset_calendar(date: Optional[str] = None, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+def reset_calendar(date: Optional[str] = None, db: Session = Depends(get_db), current_user: CurrentUser = Depends(get_current_user)):
     if date: db.query(PlannedTask).filter(PlannedTask.user_id == current_user.id, PlannedTask.date == date).delete()
     else: db.query(PlannedTask).filter(PlannedTask.user_id == current_user.id).delete()
     db.commit()
     return {"status": "Calendar Cleared"}
 
 @app.put("/calendar/update/{task_id}")
-def update_calendar_task(task_id: int, update: TaskUpdate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+def update_calendar_task(task_id: int, update: TaskUpdate, db: Session = Depends(get_db), current_user: CurrentUser = Depends(get_current_user)):
     db_task = db.query(PlannedTask).filter(PlannedTask.id == task_id, PlannedTask.user_id == current_user.id).first()
     if not db_task: raise HTTPException(status_code=404, detail="Task not found")
     db_task.task = update.task
@@ -307,13 +562,8 @@ def update_calendar_task(task_id: int, update: TaskUpdate, db: Session = Depends
     return {"status": "Updated"}
 
 @app.post("/generate-quiz")
-def generate_quiz(req: QuizRequest): # No Auth needed for quiz generation logic itself
-    prompt = f"Create 3 hard MCQs for '{req.topic}'. Return JSON: {{ 'questions': [ {{ 'question': '?', 'options': ['A','B'], 'answer': 'A' }} ] }}"
+async def generate_quiz(req: QuizRequest): # No Auth needed for quiz generation logic itself
     try:
-        response = client.models.generate_content(
-            model=get_best_model(), contents=prompt,
-            config=types.GenerateContentConfig(response_mime_type="application/json")
-        )
-        return json.loads(response.text)
+        return await _cached_gen(_quiz_cache_key(req.topic), _quiz_prompt(req.topic), "quiz", semantic_text=req.topic)
     except: return {"error": "Quiz failed"}
 
@@ -276,13 +276,10 @@ const handleAuth = async (e) => {
       });
       setSchedule(res.data);
       setCompletedTasks({});
-      const savePromises = res.data.schedule.map(item => {
-          return api.post('/calendar/add', { 
-              date: dateStr, time: item.time, task: item.task, type: item.type,
-              reason: item.reason, key_concepts: item.key_concepts || [], suggested_resources: item.suggested_resources || []
-          });
-      });
-      await Promise.all(savePromises);
+      await api.post('/calendar/add-batch', res.data.schedule.map(item => ({
+          date: dateStr, time: item.time, task: item.task, type: item.type,
+          reason: item.reason, key_concepts: item.key_concepts || [], suggested_resources: item.suggested_resources || []
+      })));
       await fetchCalendarTasks(selectedDate);
       setActiveTab('planner');
       checkLiveStatus(new Date());